@@ -0,0 +1,11 @@
+"""
+Settings for niki_shop project.
+
+DJANGO_ENV selects the layer on top of base.py: "dev" (default) or "prod".
+"""
+import os
+
+if os.environ.get("DJANGO_ENV", "dev") == "prod":
+    from .prod import *  # noqa: F401,F403
+else:
+    from .dev import *  # noqa: F401,F403
@@ -1,6 +1,9 @@
 """
 Django settings for niki_shop project.
 
+Settings shared by every environment. The environment specific modules
+(dev.py, prod.py) import from here, see niki_shop/settings/__init__.py.
+
 Generated by 'django-admin startproject' using Django 3.2.6.
 
 For more information on this file, see
@@ -13,17 +16,9 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
-BASE_DIR = Path(__file__).resolve().parent.parent
-
-
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "django-insecure-%ywabv=2sr(&^gzal4&hh*49rle$x9r3)dsm0pr1cron9lnp84"
-
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = False
 
 ALLOWED_HOSTS = []
 
@@ -32,7 +27,6 @@ ALLOWED_HOSTS = []
 
 INSTALLED_APPS = [
     "shop.apps.ShopConfig",
-    "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
@@ -132,6 +126,42 @@ STATIC_URL = "/static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
-STRIPE_PUBLISHABLE_KEY = "pk_test_51JNGDWAjmPP8lkXWjV6b8ylvPfpJj4MJ8sSK1wtebcGnlyXszmYa3ufnzNMFRKbnunORgiTOVxmRGcMLdRnInOit00v5N2aGDa"
-STRIPE_SECRET_KEY = "sk_test_51JNGDWAjmPP8lkXWuFoWLKkMK3SACASZztIl1nW1HB8cHCMB1VUYCXsxDmUMep1xk4c5WCorduGONaK4fTiDyl4Q00V2lWiWSK"
 STRIPE_ENDPOINT_SECRET = ""
+
+# Upper bound for importing niki_shop.wsgi / niki_shop.asgi in a fresh
+# interpreter, checked by the import_budget management command.
+SHOP_IMPORT_TIME_BUDGET_MS = 750
+# Modules that are imported on first use and must not be loaded at startup.
+SHOP_LAZY_IMPORTS = ["stripe"]
+
+# How long a checkout submission key is remembered, repeated submissions
+# within this window reuse the first Stripe checkout session.
+SHOP_IDEMPOTENCY_TTL = 60 * 60
+
+# Stripe checkout sessions expire after 24 hours, incomplete purchases
+# older than this are reaped by the reap_checkouts command.
+SHOP_CHECKOUT_EXPIRY = 24 * 60 * 60
+
+# Cache alias for the stock counters, see shop/inventory.py. It must be a
+# dedicated cache shared by all processes that never evicts (redis with
+# noeviction), sold items are written to the database by the flush_inventory
+# command. None keeps stock in the database.
+SHOP_INVENTORY_CACHE = None
+SHOP_INVENTORY_TTL = 60 * 60
+SHOP_INVENTORY_LOCK_TIMEOUT = 5
+SHOP_INVENTORY_FLUSH_TIMEOUT = 5 * 60
+
+# Admin changelists show the planner's row estimate instead of COUNT(*)
+# for unfiltered tables bigger than this.
+SHOP_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Statements of finished months are kept here, see shop/statements.py.
+SHOP_STATEMENTS_DIR = BASE_DIR / "statements"
+SHOP_STATEMENT_CHUNK_SIZE = 2000
+
+# Home page data is cached per user for this long and built in the
+# background after login by this many threads per process. It lists this
+# many of the latest purchases and sales.
+SHOP_DASHBOARD_TTL = 60
+SHOP_PREFETCH_WORKERS = 4
+SHOP_DASHBOARD_PURCHASES = 50
@@ -0,0 +1,17 @@
+"""
+Development settings for niki_shop project - unsuitable for production.
+
+See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
+"""
+from .base import *  # noqa: F401,F403
+from .base import INSTALLED_APPS
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = "django-insecure-%ywabv=2sr(&^gzal4&hh*49rle$x9r3)dsm0pr1cron9lnp84"
+
+DEBUG = True
+
+INSTALLED_APPS = INSTALLED_APPS + ["django.contrib.admin"]
+
+STRIPE_PUBLISHABLE_KEY = "pk_test_51JNGDWAjmPP8lkXWjV6b8ylvPfpJj4MJ8sSK1wtebcGnlyXszmYa3ufnzNMFRKbnunORgiTOVxmRGcMLdRnInOit00v5N2aGDa"
+STRIPE_SECRET_KEY = "sk_test_51JNGDWAjmPP8lkXWuFoWLKkMK3SACASZztIl1nW1HB8cHCMB1VUYCXsxDmUMep1xk4c5WCorduGONaK4fTiDyl4Q00V2lWiWSK"
@@ -0,0 +1,61 @@
+"""
+Production settings for niki_shop project.
+
+Use with DJANGO_ENV=prod. Secrets come from the environment.
+"""
+import copy
+import os
+
+from .base import *  # noqa: F401,F403
+from .base import INSTALLED_APPS, TEMPLATES
+
+SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost").split(",")
+
+# The admin is only loaded on workers that serve it, everything else boots
+# without importing it.
+if os.environ.get("DJANGO_ENABLE_ADMIN") == "1":
+    INSTALLED_APPS = INSTALLED_APPS + ["django.contrib.admin"]
+
+# Templates are parsed once per process by the cached loader and warmed in
+# ShopConfig.ready, so no request pays for reading them from disk.
+TEMPLATES = copy.deepcopy(TEMPLATES)
+TEMPLATES[0]["APP_DIRS"] = False
+TEMPLATES[0]["OPTIONS"]["loaders"] = [
+    (
+        "django.template.loaders.cached.Loader",
+        [
+            "django.template.loaders.filesystem.Loader",
+            "django.template.loaders.app_directories.Loader",
+        ],
+    ),
+]
+TEMPLATES[0]["OPTIONS"]["context_processors"] = [
+    processor
+    for processor in TEMPLATES[0]["OPTIONS"]["context_processors"]
+    if processor != "django.template.context_processors.debug"
+]
+
+SHOP_WARM_TEMPLATES = True
+
+STRIPE_PUBLISHABLE_KEY = os.environ["STRIPE_PUBLISHABLE_KEY"]
+STRIPE_SECRET_KEY = os.environ["STRIPE_SECRET_KEY"]
+STRIPE_ENDPOINT_SECRET = os.environ.get("STRIPE_ENDPOINT_SECRET", "")
+
+# Checkout dedup keys and stock counters must be shared by all workers.
+# Unflushed sales are only kept in the inventory cache, its Redis must run
+# with maxmemory-policy noeviction.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": os.environ["MEMCACHED_LOCATION"].split(","),
+    },
+    "inventory": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["INVENTORY_REDIS_URL"],
+    },
+}
+SHOP_INVENTORY_CACHE = "inventory"
@@ -1,8 +1,119 @@
-from django.contrib import admin
-from .models import StripeData, Product, BuyProducts
+from collections import defaultdict
 
-# Register your models here.
-admin.site.register(StripeData)
-admin.site.register(Product)
-admin.site.register(BuyProducts)
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db import transaction
+from . import analytics, dashboard, inventory, statements
+from .models import StripeData, Product, ProductPurchase
+from .paginators import EstimatedCountPaginator
 
+
+class PriceActionForm(ActionForm):
+    price = forms.FloatField(required=False, min_value=0)
+
+
+@admin.register(StripeData)
+class StripeDataAdmin(admin.ModelAdmin):
+    list_display = ["user", "stripe_id"]
+    list_select_related = ["user"]
+    raw_id_fields = ["user"]
+    search_fields = ["stripe_id"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ["name", "user", "price", "currency", "total_quantity"]
+    list_select_related = ["user"]
+    list_filter = ["currency"]
+    raw_id_fields = ["user"]
+    search_fields = ["name"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    action_form = PriceActionForm
+    actions = ["set_price"]
+
+    @admin.action(description="Set price of selected products")
+    def set_price(self, request, queryset):
+        form = PriceActionForm(request.POST)
+        form.fields["action"].choices = self.get_action_choices(request)
+        if not form.is_valid() or form.cleaned_data["price"] is None:
+            self.message_user(request, "Enter a valid price", messages.ERROR)
+            return
+        updated = queryset.update(price=form.cleaned_data["price"])
+        dashboard.forget(*queryset.values_list("user_id", flat=True).distinct())
+        self.message_user(request, f"Changed the price of {updated} products")
+
+
+@admin.register(ProductPurchase)
+class ProductPurchaseAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "product_name",
+        "buyer",
+        "quantity",
+        "product_price",
+        "product_currency",
+        "completed",
+        "expired",
+        "date_purchased",
+    ]
+    list_select_related = ["buyer"]
+    list_filter = ["completed", "date_purchased"]
+    raw_id_fields = ["buyer", "product"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ["mark_completed"]
+    complete_batch_size = 500
+
+    @admin.action(description="Mark selected purchases as completed")
+    def mark_completed(self, request, queryset):
+        completed = 0
+        last_id = 0
+        while True:
+            count, last_id = self.complete_chunk(queryset, last_id)
+            completed += count
+            if last_id is None:
+                break
+        self.message_user(request, f"Marked {completed} purchases as completed")
+
+    def complete_chunk(self, queryset, last_id):
+        """Complete the next chunk of pending purchases after `last_id`.
+
+        The rows are locked first, so a webhook completing one of them at
+        the same time waits and then sees it completed. Returns the number
+        of completed purchases and the last id, None when done.
+        """
+        with transaction.atomic():
+            pending = (
+                queryset.filter(completed=False, id__gt=last_id)
+                .select_related(None)
+                .select_for_update()
+                .order_by("id")
+                .only("buyer", "product", "quantity", "product_price", "expired", "date_purchased")
+            )
+            purchases = list(pending[: self.complete_batch_size])
+            if not purchases:
+                return 0, None
+            ProductPurchase.objects.filter(
+                id__in=[purchase.id for purchase in purchases], completed=False
+            ).update(completed=True, expired=False)
+            retaken = defaultdict(int)
+            for purchase in purchases:
+                if purchase.expired:
+                    retaken[purchase.product_id] -= purchase.quantity
+            # Expired purchases already gave their stock back, take it again.
+            inventory.adjust_stock(retaken)
+            analytics.record_sales(purchases)
+
+        statements.invalidate(purchases)
+        for product_id in retaken:
+            inventory.forget(product_id)
+        sellers = Product.objects.filter(
+            id__in={purchase.product_id for purchase in purchases}
+        ).values_list("user_id", flat=True)
+        dashboard.forget(*{purchase.buyer_id for purchase in purchases}, *sellers)
+        next_id = purchases[-1].id if len(purchases) == self.complete_batch_size else None
+        return len(purchases), next_id
@@ -0,0 +1,148 @@
+"""
+Per product sales rolled up by hour, day and month.
+
+Completed purchases are added to ProductSalesRollup as they complete, so
+sales charts read a few rows per bucket instead of the purchase history.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from django.utils import timezone
+
+from .models import ProductPurchase, ProductSalesRollup
+
+TRUNCATE = {
+    ProductSalesRollup.HOUR: TruncHour,
+    ProductSalesRollup.DAY: TruncDay,
+    ProductSalesRollup.MONTH: TruncMonth,
+}
+
+
+def bucket_start(moment, period):
+    # Same buckets as the Trunc functions, which use the current time zone.
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if period in (ProductSalesRollup.DAY, ProductSalesRollup.MONTH):
+        moment = moment.replace(hour=0)
+    if period == ProductSalesRollup.MONTH:
+        moment = moment.replace(day=1)
+    return moment
+
+
+def _add(product_id, period, bucket, quantity, revenue):
+    rollup = ProductSalesRollup.objects.filter(
+        product_id=product_id, period=period, bucket=bucket
+    )
+    changes = {"quantity": F("quantity") + quantity, "revenue": F("revenue") + revenue}
+    if rollup.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            ProductSalesRollup.objects.create(
+                product_id=product_id,
+                period=period,
+                bucket=bucket,
+                quantity=quantity,
+                revenue=revenue,
+            )
+    except IntegrityError:
+        # Another completion created the bucket first.
+        rollup.update(**changes)
+
+
+def record_sales(purchases):
+    """Add completed `purchases` to the hourly, daily and monthly rollups.
+
+    Existing buckets are locked and updated with one bulk UPDATE, missing
+    ones created with one INSERT.
+    """
+    totals = defaultdict(lambda: [0, 0.0])
+    for purchase in purchases:
+        for period in TRUNCATE:
+            bucket = bucket_start(purchase.date_purchased, period)
+            total = totals[(purchase.product_id, period, bucket)]
+            total[0] += purchase.quantity
+            total[1] += purchase.quantity * purchase.product_price
+    if not totals:
+        return
+
+    with transaction.atomic():
+        existing = {
+            (rollup.product_id, rollup.period, rollup.bucket): rollup
+            for rollup in ProductSalesRollup.objects.select_for_update().filter(
+                product_id__in={key[0] for key in totals},
+                bucket__in={key[2] for key in totals},
+            )
+        }
+        changed, missing = [], []
+        for key, (quantity, revenue) in sorted(totals.items()):
+            rollup = existing.get(key)
+            if rollup is None:
+                product_id, period, bucket = key
+                missing.append(
+                    ProductSalesRollup(
+                        product_id=product_id,
+                        period=period,
+                        bucket=bucket,
+                        quantity=quantity,
+                        revenue=revenue,
+                    )
+                )
+            else:
+                rollup.quantity += quantity
+                rollup.revenue += revenue
+                changed.append(rollup)
+        ProductSalesRollup.objects.bulk_update(changed, ["quantity", "revenue"], batch_size=1000)
+        try:
+            with transaction.atomic():
+                ProductSalesRollup.objects.bulk_create(missing, batch_size=1000)
+        except IntegrityError:
+            # Another completion created some of the buckets first.
+            for rollup in missing:
+                _add(rollup.product_id, rollup.period, rollup.bucket, rollup.quantity, rollup.revenue)
+
+
+def rebuild_rollups():
+    """Recompute every rollup from the completed purchases."""
+    with transaction.atomic():
+        ProductSalesRollup.objects.all().delete()
+        for period, truncate in TRUNCATE.items():
+            rows = (
+                ProductPurchase.objects.filter(completed=True)
+                .annotate(bucket=truncate("date_purchased"))
+                .values("product_id", "bucket")
+                .annotate(
+                    total_quantity=Sum("quantity"),
+                    total_revenue=Sum(F("quantity") * F("product_price")),
+                )
+                .order_by()
+            )
+            ProductSalesRollup.objects.bulk_create(
+                [
+                    ProductSalesRollup(
+                        product_id=row["product_id"],
+                        period=period,
+                        bucket=row["bucket"],
+                        quantity=row["total_quantity"],
+                        revenue=row["total_revenue"],
+                    )
+                    for row in rows
+                ],
+                batch_size=1000,
+            )
+
+
+def seller_sales(seller, period, start, end):
+    return list(
+        ProductSalesRollup.objects.filter(
+            product__user=seller,
+            period=period,
+            bucket__gte=bucket_start(start, period),
+            bucket__lt=end,
+        )
+        .order_by("bucket", "product_id")
+        .values("product_id", "product__name", "bucket", "quantity", "revenue")
+    )
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from .inventory import counter_cache
+
+        # Fails on a cache that is not shared between processes.
+        counter_cache()
+
+        if getattr(settings, "SHOP_WARM_TEMPLATES", False):
+            from .template_warmup import warm_templates
+
+            warm_templates()
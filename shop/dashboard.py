@@ -0,0 +1,152 @@
+"""
+Data shown on the home page, cached per user.
+
+Logging in starts building the user's dashboard on a thread pool, so it is
+usually in the cache by the time the browser follows the redirect to home.
+
+The products of other sellers are the same for every user and change with
+every seller's edits, they are queried on each request instead.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Product, ProductPurchase
+from .payments import get_stripe_account
+
+logger = logging.getLogger(__name__)
+
+# How long a request waits for a warm-up of its dashboard that is already running.
+PREFETCH_WAIT = 5
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = {}
+
+
+def dashboard_key(user_id):
+    return f"dashboard:{user_id}"
+
+
+def version_key(user_id):
+    return f"dashboard:{user_id}:version"
+
+
+# Fields of a purchase shown on the home page.
+PURCHASE_FIELDS = ["product_id", "product_name", "product_price", "product_currency", "quantity"]
+
+
+def my_products(user):
+    return list(user.product_set.values("id", "name"))
+
+
+def others_products(user):
+    return list(Product.objects.exclude(user=user))
+
+
+def latest_purchases(purchases):
+    """The newest SHOP_DASHBOARD_PURCHASES `purchases`, so a dashboard stays small."""
+    return list(
+        purchases.order_by("-date_purchased", "-id").values(*PURCHASE_FIELDS)[
+            : settings.SHOP_DASHBOARD_PURCHASES
+        ]
+    )
+
+
+def purchased_products(user):
+    return latest_purchases(user.productpurchase_set.all())
+
+
+def sell_products(user):
+    return latest_purchases(ProductPurchase.objects.filter(product__user=user))
+
+
+def build_dashboard(user):
+    stripe_account = get_stripe_account(user)
+    stripe_user = None
+    if stripe_account:
+        # Only what home.html reads, Stripe objects are kept out of the cache.
+        stripe_user = {
+            "id": stripe_account.id,
+            "charges_enabled": bool(stripe_account.charges_enabled),
+            "details_submitted": bool(stripe_account.details_submitted),
+        }
+    return {
+        "stripe": stripe_user["id"] if stripe_user else None,
+        "stripe_user": stripe_user,
+        "my_products": my_products(user),
+        "purchased_products": purchased_products(user),
+        "sell_products": sell_products(user),
+    }
+
+
+def _cached(user_id):
+    cached = cache.get_many([dashboard_key(user_id), version_key(user_id)])
+    entry = cached.get(dashboard_key(user_id))
+    # Entries built before the last forget() carry an older version.
+    if entry is not None and entry[0] == cached.get(version_key(user_id)):
+        return entry[1]
+    return None
+
+
+def _store(user):
+    """Build and cache the dashboard of `user`.
+
+    The version is read before building, so a forget() while this runs
+    makes the stored entry stale instead of being overwritten by it.
+    """
+    cache.add(version_key(user.id), uuid.uuid4().hex, None)
+    version = cache.get(version_key(user.id))
+    data = build_dashboard(user)
+    cache.set(dashboard_key(user.id), (version, data), settings.SHOP_DASHBOARD_TTL)
+    return data
+
+
+def get_dashboard(user):
+    data = _cached(user.id)
+    if data is None and user.id in _pending:
+        wait([_pending[user.id]], timeout=PREFETCH_WAIT)
+        data = _cached(user.id)
+    if data is None:
+        data = _store(user)
+    return {**data, "others_products": others_products(user)}
+
+
+def forget(*user_ids):
+    cache.set_many({version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, None)
+    cache.delete_many([dashboard_key(user_id) for user_id in user_ids])
+
+
+def _warm(user_id):
+    try:
+        _store(User.objects.get(pk=user_id))
+    except Exception:
+        logger.exception("Warming the dashboard of user %s failed", user_id)
+    finally:
+        connection.close()
+
+
+def prefetch(user_id):
+    """Build the dashboard of `user_id` in the background, returns the future."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SHOP_PREFETCH_WORKERS, thread_name_prefix="dashboard"
+            )
+        future = _executor.submit(_warm, user_id)
+        _pending[user_id] = future
+    future.add_done_callback(lambda done: _forget_pending(user_id, done))
+    return future
+
+
+def _forget_pending(user_id, future):
+    with _executor_lock:
+        if _pending.get(user_id) is future:
+            del _pending[user_id]
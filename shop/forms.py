@@ -1,15 +1,13 @@
-import stripe
+import uuid
 
 from django import forms
 from django.db import transaction
 from django.forms import ModelForm
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password, check_password
-from niki_shop.settings import STRIPE_SECRET_KEY
+from . import dashboard, inventory
 from .models import Product, ProductPurchase
 
-stripe.api_key = STRIPE_SECRET_KEY
-
 
 class RegisterUserForm(ModelForm):
     class Meta:
@@ -77,12 +75,13 @@ class LoginUserForm(ModelForm):
     def save(self, request):
         user = self.cleaned_data["user"]
         request.session["user_id"] = user.id
+        dashboard.prefetch(user.id)
 
 
 class ProductForm(ModelForm):
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
         self.user = kwargs.pop("user")
+        super().__init__(*args, **kwargs)
         if not getattr(self.instance, "user", None):
             self.instance.user = self.user
 
@@ -103,12 +102,21 @@ class ProductForm(ModelForm):
             raise forms.ValidationError("Not your product")
         return cleaned_data
 
+    def save(self, commit=True):
+        product = super().save(commit)
+        if commit:
+            inventory.forget(product.id)
+        return product
+
 
 class BuyProductsForm(ModelForm):
+    idempotency_key = forms.CharField(widget=forms.HiddenInput(), max_length=64)
+
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop("user")
         self.product = kwargs.pop("product")
         super().__init__(*args, **kwargs)
+        self.fields["idempotency_key"].initial = uuid.uuid4().hex
 
     class Meta:
         model = Product
@@ -119,8 +127,21 @@ class BuyProductsForm(ModelForm):
         cleaned_data = super(BuyProductsForm, self).clean()
         if cleaned_data["total_quantity"] <= 0:
             raise ValueError("Quantity can't be 0 or less")
+        if cleaned_data["total_quantity"] > inventory.get_stock(self.product.id):
+            raise forms.ValidationError("Not enough items in stock")
         return cleaned_data
 
+    def checkout_key(self):
+        """Same key for every resubmission of one rendered form by one buyer.
+
+        Read from the raw data, a resubmission must find its purchase even when
+        the stock it reserved makes the form invalid now.
+        """
+        token = self.data.get("idempotency_key", "")
+        if not token or len(token) > 64:
+            return None
+        return "checkout:{}:{}:{}".format(self.user.id, self.product.id, token)
+
     @transaction.atomic
     def save(self, commit=True):
         purchase = ProductPurchase(
@@ -132,5 +153,8 @@ class BuyProductsForm(ModelForm):
             quantity=self.cleaned_data["total_quantity"],
         )
         purchase.save()
-        self.product.total_quantity -= purchase.quantity
-        self.product.save()
+        try:
+            inventory.reserve(self.product.id, purchase.quantity)
+        except inventory.OutOfStock as e:
+            raise forms.ValidationError(str(e))
+        return purchase
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PENDING = "pending"
+
+
+def claim(key):
+    """Reserve `key` for this request, False if another request already holds it."""
+    return cache.add(key, PENDING, settings.SHOP_IDEMPOTENCY_TTL)
+
+
+def complete(key, result):
+    """Store `result` for `key`, a dict with "pending": True while work goes on."""
+    cache.set(key, result, settings.SHOP_IDEMPOTENCY_TTL)
+
+
+def is_pending(value):
+    return value == PENDING or (isinstance(value, dict) and value.get("pending", False))
+
+
+def release(key):
+    cache.delete(key)
+
+
+def result(key, wait=2.0, interval=0.1):
+    """Return what is stored for `key`, waiting a little while it is pending.
+
+    None when the key is unknown, a pending value when it is still pending
+    after `wait`.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        value = cache.get(key)
+        if not is_pending(value) or time.monotonic() >= deadline:
+            return value
+        time.sleep(interval)
@@ -0,0 +1,295 @@
+"""
+Stock counters kept in a shared cache in front of Product.total_quantity.
+
+Purchases decrement the cached counter atomically, add to a per product
+"sold" counter and mark the product dirty. flush() later writes the sold
+counters of the dirty products to the database in batches, so a hot product
+is not written on every purchase.
+
+The counters need a dedicated cache that is shared by every process and
+never evicts (SHOP_INVENTORY_CACHE), unflushed sales only exist there.
+Without one, purchases decrement total_quantity in the database directly.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Product
+
+# Counters are stored with an offset because some backends (memcached) clamp
+# decr at zero, which would hide overselling and undone sales.
+OFFSET = 2 ** 31
+
+DIRTY_SEQ = "inventory:dirty:seq"
+DIRTY_DONE = "inventory:dirty:done"
+DIRTY_STALLED = "inventory:dirty:stalled"
+FLUSH_LOCK = "inventory:flush:lock"
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def stock_key(product_id):
+    return f"inventory:{product_id}:stock"
+
+
+def sold_key(product_id):
+    return f"inventory:{product_id}:sold"
+
+
+def lock_key(product_id):
+    return f"inventory:{product_id}:lock"
+
+
+def dirty_key(seq):
+    return f"inventory:dirty:{seq}"
+
+
+def counter_cache():
+    """The cache holding the counters, None when stock is kept in the database only."""
+    alias = settings.SHOP_INVENTORY_CACHE
+    if not alias:
+        return None
+    location = settings.CACHES[alias].get("LOCATION")
+    if alias == DEFAULT_CACHE_ALIAS or location == settings.CACHES[DEFAULT_CACHE_ALIAS].get("LOCATION"):
+        # Unflushed sales only exist in the sold counters, they must not be
+        # evicted to make room for other entries.
+        raise ImproperlyConfigured(
+            "SHOP_INVENTORY_CACHE must be a dedicated cache that never evicts, "
+            "not the default cache"
+        )
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            "SHOP_INVENTORY_CACHE must be shared by all processes, "
+            f"{type(cache).__name__} is not"
+        )
+    return cache
+
+
+def adjust_stock(deltas):
+    """Add `deltas` ({product_id: quantity}) to total_quantity in one UPDATE."""
+    if not deltas:
+        return
+    Product.objects.filter(id__in=deltas).update(
+        total_quantity=F("total_quantity")
+        + Case(
+            *[When(id=product_id, then=Value(delta)) for product_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def _local_lock(product_id):
+    with _local_locks_guard:
+        return _local_locks.setdefault(product_id, threading.Lock())
+
+
+def _stock_from_db(cache, product_id):
+    total_quantity = (
+        Product.objects.filter(id=product_id)
+        .values_list("total_quantity", flat=True)
+        .first()
+    )
+    if total_quantity is None:
+        raise Product.DoesNotExist(product_id)
+    return total_quantity - _sold(cache.get(sold_key(product_id))) + OFFSET
+
+
+def _sold(value):
+    return value - OFFSET if value is not None else 0
+
+
+def _load(cache, product_id):
+    """Fill the counter from the database, one loader per product at a time.
+
+    Threads of this process queue on a local lock, other processes on the
+    product's lock key. flush() holds the same key while it moves sold items
+    to the database, so total_quantity and the sold counter are always read
+    in a consistent state. Returns None when the lock stays taken.
+    """
+    key = stock_key(product_id)
+    deadline = time.monotonic() + settings.SHOP_INVENTORY_LOCK_TIMEOUT
+    with _local_lock(product_id):
+        while True:
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.add(lock_key(product_id), 1, settings.SHOP_INVENTORY_LOCK_TIMEOUT):
+                try:
+                    value = _stock_from_db(cache, product_id)
+                    cache.add(key, value, settings.SHOP_INVENTORY_TTL)
+                finally:
+                    cache.delete(lock_key(product_id))
+                return cache.get(key, value)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)
+
+
+def get_stock(product_id):
+    cache = counter_cache()
+    if cache is None:
+        return Product.objects.values_list("total_quantity", flat=True).get(id=product_id)
+
+    value = cache.get(stock_key(product_id))
+    if value is None:
+        value = _load(cache, product_id)
+    if value is None:
+        # Only shown to the buyer, reserve() still checks the counter.
+        value = _stock_from_db(cache, product_id)
+    return value - OFFSET
+
+
+def _mark_dirty(cache, product_id):
+    cache.add(DIRTY_SEQ, 0, None)
+    cache.set(dirty_key(cache.incr(DIRTY_SEQ)), product_id, None)
+
+
+def reserve(product_id, quantity):
+    """Take `quantity` items, raise OutOfStock if there are not enough."""
+    cache = counter_cache()
+    if cache is None:
+        updated = Product.objects.filter(id=product_id, total_quantity__gte=quantity).update(
+            total_quantity=F("total_quantity") - quantity
+        )
+        if not updated:
+            raise OutOfStock("Not enough items in stock")
+        return
+
+    key = stock_key(product_id)
+    if cache.get(key) is None and _load(cache, product_id) is None:
+        raise OutOfStock("Stock is being updated, please try again")
+
+    # Counted as sold before the counter is taken, so a reload in between
+    # can only undercount the stock.
+    cache.add(sold_key(product_id), OFFSET, None)
+    cache.incr(sold_key(product_id), quantity)
+    _mark_dirty(cache, product_id)
+    try:
+        remaining = cache.decr(key, quantity)
+    except ValueError:
+        # Expired or forgotten meanwhile, a reload already counts this sale.
+        remaining = _load(cache, product_id)
+        if remaining is None:
+            cache.decr(sold_key(product_id), quantity)
+            raise OutOfStock("Stock is being updated, please try again")
+
+    if remaining < OFFSET:
+        cache.incr(key, quantity)
+        cache.decr(sold_key(product_id), quantity)
+        raise OutOfStock(f"Only {max(remaining + quantity - OFFSET, 0)} items left")
+
+
+def forget(product_id):
+    """Drop the counter after total_quantity was changed in the database.
+
+    The next reader loads it again as total_quantity minus the unflushed sales.
+    """
+    cache = counter_cache()
+    if cache is not None:
+        cache.delete(stock_key(product_id))
+
+
+def flush(batch_size=500, all_products=False):
+    """Write the sold counters of dirty products to the database.
+
+    Returns the number of products written. `all_products` checks every
+    product instead, to recover marks lost by a crashed worker.
+    """
+    cache = counter_cache()
+    if cache is None or not cache.add(FLUSH_LOCK, 1, settings.SHOP_INVENTORY_FLUSH_TIMEOUT):
+        return 0
+    try:
+        if all_products:
+            return _flush_all(cache, batch_size)
+        return _flush_dirty(cache, batch_size)
+    finally:
+        cache.delete(FLUSH_LOCK)
+
+
+def _flush_dirty(cache, batch_size):
+    flushed = 0
+    done = cache.get(DIRTY_DONE)
+    last = cache.get(DIRTY_SEQ) or 0
+    if done is None:
+        # First run, or the position was evicted: start at the end and check
+        # every product once.
+        cache.set(DIRTY_DONE, last, None)
+        return _flush_all(cache, batch_size)
+    while done < last:
+        seqs = range(done + 1, min(done + batch_size, last) + 1)
+        slots = cache.get_many([dirty_key(seq) for seq in seqs])
+        product_ids = set()
+        for seq in seqs:
+            if dirty_key(seq) not in slots:
+                # Numbered but not written yet, or lost with its worker. Wait
+                # one run for it before skipping it.
+                if cache.get(DIRTY_STALLED) != seq:
+                    cache.set(DIRTY_STALLED, seq, None)
+                    break
+            else:
+                product_ids.add(slots[dirty_key(seq)])
+            done = seq
+
+        flushed += _flush_products(cache, product_ids)
+        cache.delete_many([dirty_key(seq) for seq in seqs if seq <= done])
+        cache.set(DIRTY_DONE, done, None)
+        if done < seqs[-1]:
+            break
+    return flushed
+
+
+def _flush_all(cache, batch_size):
+    flushed = 0
+    last_id = 0
+    while True:
+        product_ids = list(
+            Product.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not product_ids:
+            return flushed
+        flushed += _flush_products(cache, product_ids)
+        last_id = product_ids[-1]
+
+
+def _flush_products(cache, product_ids):
+    locked = []
+    for product_id in sorted(product_ids):
+        if cache.add(lock_key(product_id), 1, settings.SHOP_INVENTORY_LOCK_TIMEOUT):
+            locked.append(product_id)
+        else:
+            # A loader is reading it, flush it next time.
+            _mark_dirty(cache, product_id)
+    try:
+        sold = cache.get_many([sold_key(product_id) for product_id in locked])
+        # Negative when a sale was undone after an earlier flush wrote it.
+        sold = {
+            product_id: _sold(sold.get(sold_key(product_id)))
+            for product_id in locked
+            if _sold(sold.get(sold_key(product_id)))
+        }
+        with transaction.atomic():
+            adjust_stock({product_id: -quantity for product_id, quantity in sold.items()})
+        for product_id, quantity in sold.items():
+            if quantity > 0:
+                cache.decr(sold_key(product_id), quantity)
+            else:
+                cache.incr(sold_key(product_id), -quantity)
+        return len(sold)
+    finally:
+        cache.delete_many([lock_key(product_id) for product_id in locked])
@@ -0,0 +1,44 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import reverse
+from shop import dashboard
+from shop.views import home
+
+
+class Command(BaseCommand):
+    help = "Time the first home page render after login, with and without the dashboard warm-up"
+
+    def add_arguments(self, parser):
+        parser.add_argument("email")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--redirect-ms",
+            type=float,
+            default=50,
+            help="Time between the login response and the request for home",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.get(email=options["email"])
+        redirect_delay = options["redirect_ms"] / 1000
+        factory = RequestFactory()
+
+        def first_home_render(warm_up):
+            dashboard.forget(user.id)
+            if warm_up:
+                dashboard.prefetch(user.id)
+            time.sleep(redirect_delay)
+            request = factory.get(reverse("home"))
+            request.session = {"user_id": user.id}
+            start = time.perf_counter()
+            home(request)
+            return (time.perf_counter() - start) * 1000
+
+        cold = [first_home_render(False) for _ in range(options["repeat"])]
+        warm = [first_home_render(True) for _ in range(options["repeat"])]
+        self.stdout.write(f"first home render, no warm-up: {statistics.median(cold):.1f} ms")
+        self.stdout.write(f"first home render, warmed up:  {statistics.median(warm):.1f} ms")
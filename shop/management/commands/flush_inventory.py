@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from shop.inventory import flush
+
+
+class Command(BaseCommand):
+    help = "Write the cached sold counters to Product.total_quantity, run periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Check every product, not only those sold since the last run",
+        )
+
+    def handle(self, *args, **options):
+        flushed = flush(options["batch_size"], all_products=options["all"])
+        self.stdout.write(f"Flushed stock of {flushed} products")
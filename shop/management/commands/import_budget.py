@@ -0,0 +1,87 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+# Loading the URLconf imports the views and forms like the first request would.
+STARTUP = "import {}; from django.urls import get_resolver; get_resolver().url_patterns"
+
+
+def measure_import(module):
+    """Start `module` in a fresh interpreter and return (total_us, [(self_us, name)])."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP.format(module)],
+        env=os.environ,
+        capture_output=True,
+        text=True,
+        cwd=settings.BASE_DIR,
+    )
+    if result.returncode != 0:
+        raise CommandError(f"Importing {module} failed:\n{result.stderr}")
+
+    total_us = 0
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        if not match.group(3):
+            total_us += int(match.group(2))
+        imports.append((int(match.group(1)), match.group(4)))
+    return total_us, imports
+
+
+def eager_imports(imports):
+    """Modules of SHOP_LAZY_IMPORTS that were imported during startup."""
+    return sorted(
+        {
+            lazy
+            for _, name in imports
+            for lazy in settings.SHOP_LAZY_IMPORTS
+            if name == lazy or name.startswith(f"{lazy}.")
+        }
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Fail when starting the WSGI/ASGI entry points exceeds the startup budget "
+        "or imports a module that must be loaded lazily"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--module",
+            action="append",
+            dest="modules",
+            help="Module to import, defaults to niki_shop.wsgi and niki_shop.asgi",
+        )
+        parser.add_argument(
+            "--budget-ms", type=float, default=settings.SHOP_IMPORT_TIME_BUDGET_MS
+        )
+        parser.add_argument("--top", type=int, default=10)
+
+    def handle(self, *args, **options):
+        modules = options["modules"] or ["niki_shop.wsgi", "niki_shop.asgi"]
+        budget_ms = options["budget_ms"]
+        over_budget = []
+        eager = []
+        for module in modules:
+            total_us, imports = measure_import(module)
+            total_ms = total_us / 1000
+            self.stdout.write(f"{module}: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+            for us, name in sorted(imports, reverse=True)[: options["top"]]:
+                self.stdout.write(f"  {us / 1000:>8.1f} ms  {name}")
+            if total_ms > budget_ms:
+                over_budget.append(module)
+            eager.extend(f"{module} imports {name}" for name in eager_imports(imports))
+
+        if eager:
+            raise CommandError(f"Imported at startup: {', '.join(eager)}")
+        if over_budget:
+            raise CommandError(f"Import time budget exceeded by: {', '.join(over_budget)}")
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shop.reaper import reap_expired_purchases
+
+
+class Command(BaseCommand):
+    help = "Expire abandoned checkouts and restore their stock, run periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.SHOP_CHECKOUT_EXPIRY,
+            help="Seconds after which an incomplete purchase is abandoned",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["older_than"])
+        reaped = reap_expired_purchases(cutoff, options["batch_size"])
+        self.stdout.write(f"Expired {reaped} abandoned purchases")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from shop.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales rollups from the completed purchases"
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write("Sales rollups rebuilt")
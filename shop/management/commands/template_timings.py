@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import get_template
+from shop.template_warmup import shop_template_names, compile_template
+
+
+class Command(BaseCommand):
+    help = "Report compile and render times for the shop templates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=100)
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        self.stdout.write(
+            f"{'template':<32}{'compile ms':>12}{'lookup ms':>12}{'render ms':>16}"
+        )
+        for name in shop_template_names():
+            start = time.perf_counter()
+            compile_template(name)
+            compile_ms = (time.perf_counter() - start) * 1000
+
+            get_template(name)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                template = get_template(name)
+            lookup_ms = (time.perf_counter() - start) * 1000 / repeat
+
+            try:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    template.render({})
+                render = f"{(time.perf_counter() - start) * 1000 / repeat:.3f}"
+            except Exception as e:
+                render = type(e).__name__
+
+            self.stdout.write(
+                f"{name:<32}{compile_ms:>12.3f}{lookup_ms:>12.3f}{render:>16}"
+            )
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_buyproducts(apps, schema_editor):
+    """Move the legacy BuyProducts rows to ProductPurchase before the table is dropped.
+
+    BuyProducts linked buyer and product through many-to-many fields, the
+    first of each becomes the foreign key. Legacy rows predate checkout
+    tracking and were all paid, so they are copied as completed. Rows whose
+    product or buyer no longer exists cannot be kept.
+    """
+    BuyProducts = apps.get_model('shop', 'BuyProducts')
+    Product = apps.get_model('shop', 'Product')
+    ProductPurchase = apps.get_model('shop', 'ProductPurchase')
+    product_ids = set(Product.objects.values_list('id', flat=True))
+
+    purchases = []
+    for old in BuyProducts.objects.prefetch_related('user', 'product').order_by('id'):
+        buyers = list(old.user.all())
+        products = list(old.product.all())
+        product_id = products[0].id if products else old.product_id
+        if not buyers or product_id not in product_ids:
+            continue
+        purchases.append(
+            ProductPurchase(
+                buyer_id=buyers[0].id,
+                product_id=product_id,
+                product_name=old.product_name or (products[0].name if products else None),
+                product_price=old.product_price,
+                product_currency=old.product_currency,
+                quantity=old.quantity,
+                completed=True,
+            )
+        )
+    ProductPurchase.objects.bulk_create(purchases)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_price_stripe_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=200, null=True)),
+                ('product_price', models.FloatField(default=0)),
+                ('product_currency', models.CharField(max_length=200)),
+                ('quantity', models.IntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('expired', models.BooleanField(default=False)),
+                ('date_purchased', models.DateTimeField(auto_now_add=True)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.product')),
+            ],
+        ),
+        migrations.RunPython(copy_buyproducts, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='BuyProducts',
+        ),
+        migrations.AddIndex(
+            model_name='productpurchase',
+            index=models.Index(fields=['completed', 'date_purchased'], name='shop_produc_complet_28deb6_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_productsalesrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='currency',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='productpurchase',
+            name='date_purchased',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
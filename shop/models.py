@@ -15,7 +15,7 @@ class Product(models.Model):
     name = models.CharField(max_length=200)
     description = models.CharField(max_length=2000)
     price = models.FloatField(default=0)
-    currency = models.CharField(max_length=200)
+    currency = models.CharField(max_length=200, db_index=True)
     total_quantity = models.IntegerField(default=0)
 
     def __str__(self):
@@ -23,11 +23,35 @@ class Product(models.Model):
 
 
 class ProductPurchase(models.Model):
-    buyer = models.ForeignKey(User)
-    product = models.ForeignKey(Product)
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
     product_name = models.CharField(max_length=200, null=True)
     product_price = models.FloatField(default=0)
     product_currency = models.CharField(max_length=200)
     quantity = models.IntegerField(default=0)
     completed = models.BooleanField(default=False)
-    date_purchased = models.DateTimeField(auto_now_add=True)
+    expired = models.BooleanField(default=False)
+    date_purchased = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["completed", "date_purchased"])]
+
+
+class ProductSalesRollup(models.Model):
+    HOUR = "hour"
+    DAY = "day"
+    MONTH = "month"
+    PERIODS = [(HOUR, "Hour"), (DAY, "Day"), (MONTH, "Month")]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIODS)
+    bucket = models.DateTimeField()
+    quantity = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "period", "bucket"], name="unique_sales_rollup"
+            )
+        ]
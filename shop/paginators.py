@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids COUNT(*) on big unfiltered tables.
+
+    An estimate is used instead once it is above
+    SHOP_ESTIMATED_COUNT_THRESHOLD, smaller or filtered tables are counted.
+    PostgreSQL estimates with the planner's row count, SQLite with the
+    highest primary key, which is an index lookup and overcounts by the
+    deleted rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate(queryset)
+            if estimate and estimate > settings.SHOP_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+    def estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            return int(row[0]) if row else None
+        if connection.vendor == "sqlite":
+            return queryset.model._default_manager.using(queryset.db).aggregate(
+                estimate=Max("pk")
+            )["estimate"]
+        return None
@@ -0,0 +1,24 @@
+from functools import lru_cache
+
+from django.conf import settings
+
+from .models import StripeData
+
+
+@lru_cache(maxsize=None)
+def get_stripe():
+    """Import and configure the Stripe client on first use."""
+    import stripe
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe
+
+
+def get_stripe_account(user):
+    try:
+        stripe_data = StripeData.objects.get(user=user)
+        return get_stripe().Account.retrieve(
+            stripe_data.stripe_id, settings.STRIPE_SECRET_KEY
+        )
+    except Exception:
+        return None
@@ -0,0 +1,44 @@
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from . import inventory
+from .models import ProductPurchase
+
+
+def reap_chunk(cutoff, batch_size):
+    """Expire one chunk of stale checkouts and give their stock back.
+
+    Each chunk is its own short transaction, so locks on shop_product are
+    only held for a single UPDATE per chunk.
+    """
+    with transaction.atomic():
+        stale = ProductPurchase.objects.filter(
+            completed=False, expired=False, date_purchased__lt=cutoff
+        ).order_by("date_purchased")
+        if connection.features.has_select_for_update_skip_locked:
+            stale = stale.select_for_update(skip_locked=True)
+        ids = list(stale.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return 0
+
+        quantities = dict(
+            ProductPurchase.objects.filter(id__in=ids)
+            .values("product_id")
+            .annotate(quantity=Sum("quantity"))
+            .values_list("product_id", "quantity")
+        )
+        ProductPurchase.objects.filter(id__in=ids).update(expired=True)
+        inventory.adjust_stock(quantities)
+
+    for product_id in quantities:
+        inventory.forget(product_id)
+    return len(ids)
+
+
+def reap_expired_purchases(cutoff, batch_size=500):
+    reaped = 0
+    while True:
+        count = reap_chunk(cutoff, batch_size)
+        reaped += count
+        if count < batch_size:
+            return reaped
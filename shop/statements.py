@@ -0,0 +1,196 @@
+"""
+Purchase receipts for buyers and payout statements for sellers.
+
+Statements are generated row by row from a database iterator and streamed,
+so a long history is never loaded into memory. Statements of finished
+months are also written to SHOP_STATEMENTS_DIR and served from there until
+a late webhook completion changes that month.
+"""
+import csv
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Product, ProductPurchase
+
+KINDS = {"receipts": "Purchase receipts", "payouts": "Payout statement"}
+FORMATS = {"csv": "text/csv", "txt": "text/plain"}
+
+HEADER = [
+    "purchase_id",
+    "date",
+    "product_id",
+    "product_name",
+    "quantity",
+    "unit_price",
+    "total",
+    "currency",
+]
+
+
+class Echo:
+    """File-like object for csv.writer that returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def month_range(year, month):
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end
+
+
+def statement_rows(user, kind, start, end):
+    purchases = ProductPurchase.objects.filter(
+        completed=True, date_purchased__gte=start, date_purchased__lt=end
+    )
+    if kind == "receipts":
+        purchases = purchases.filter(buyer=user)
+    else:
+        purchases = purchases.filter(product__user=user)
+    rows = purchases.order_by("date_purchased", "id").values_list(
+        "id",
+        "date_purchased",
+        "product_id",
+        "product_name",
+        "quantity",
+        "product_price",
+        "product_currency",
+    )
+    for purchase_id, date, product_id, name, quantity, price, currency in rows.iterator(
+        chunk_size=settings.SHOP_STATEMENT_CHUNK_SIZE
+    ):
+        yield [purchase_id, date, product_id, name, quantity, price, quantity * price, currency]
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        row[1] = row[1].isoformat()
+        yield writer.writerow(row)
+
+
+def text_lines(user, kind, start, end, rows):
+    yield f"Niki's Shop - {KINDS[kind]}\n"
+    yield f"{user.get_full_name() or user.username} <{user.email}>\n"
+    yield f"{start:%Y-%m-%d} - {end:%Y-%m-%d}\n\n"
+    yield f"{'date':<17}{'product':<32}{'qty':>6}{'price':>12}{'total':>12}\n"
+    totals = defaultdict(float)
+    for _, date, _, name, quantity, price, total, currency in rows:
+        totals[currency] += total
+        yield f"{date:%Y-%m-%d %H:%M} {(name or '')[:30]:<32}{quantity:>6}{price:>12.2f}{total:>8.2f} {currency}\n"
+    yield "\n"
+    for currency, total in sorted(totals.items()):
+        yield f"Total {currency}: {total:.2f}\n"
+
+
+def generate(user, kind, start, end, fmt):
+    """Yield the statement of `user` for [start, end) line by line."""
+    rows = statement_rows(user, kind, start, end)
+    if fmt == "csv":
+        return csv_lines(rows)
+    return text_lines(user, kind, start, end, rows)
+
+
+def user_dir(user_id):
+    return Path(settings.SHOP_STATEMENTS_DIR) / str(user_id)
+
+
+def cache_path(user_id, kind, year, month, fmt):
+    return user_dir(user_id) / f"{year}-{month:02}-{kind}.{fmt}"
+
+
+def generation_path(path):
+    return path.with_name(f"{path.name}.generation")
+
+
+def _generation(path):
+    try:
+        return generation_path(path).read_text()
+    except FileNotFoundError:
+        return None
+
+
+def _bump_generation(path):
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(uuid.uuid4().hex)
+    os.replace(tmp_path, generation_path(path))
+
+
+def _write_through(lines, path):
+    """Yield `lines` and store them at `path` once all of them were sent.
+
+    invalidate() bumps the path's generation before deleting it. If that
+    happened while the lines were generated, the stored file may miss the
+    new purchase and is deleted again.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    generation = _generation(path)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    completed = False
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as tmp_file:
+            for line in lines:
+                tmp_file.write(line)
+                yield line
+        os.replace(tmp_path, path)
+        completed = True
+        if _generation(path) != generation:
+            path.unlink(missing_ok=True)
+    finally:
+        if not completed:
+            tmp_path.unlink(missing_ok=True)
+
+
+def _read_chunks(path, chunk_size=64 * 1024):
+    with open(path, encoding="utf-8", newline="") as cached:
+        while True:
+            chunk = cached.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def monthly_statement(user, kind, year, month, fmt):
+    """Yield a month's statement, from the disk cache once the month is over."""
+    start, end = month_range(year, month)
+    path = cache_path(user.id, kind, year, month, fmt)
+    if path.exists():
+        return _read_chunks(path)
+    lines = generate(user, kind, start, end, fmt)
+    if end > timezone.now():
+        return lines
+    return _write_through(lines, path)
+
+
+def invalidate(purchases):
+    """Drop cached months of the buyers and sellers of newly completed `purchases`."""
+    purchases = list(purchases)
+    sellers = dict(
+        Product.objects.filter(
+            id__in={purchase.product_id for purchase in purchases}
+        ).values_list("id", "user_id")
+    )
+    months = set()
+    for purchase in purchases:
+        month = timezone.localtime(purchase.date_purchased)
+        months.add((purchase.buyer_id, "receipts", month.year, month.month))
+        if purchase.product_id in sellers:
+            months.add((sellers[purchase.product_id], "payouts", month.year, month.month))
+    now = timezone.now()
+    for user_id, kind, year, month in months:
+        # The current month is never stored. Users without a directory have
+        # no stored statements, and a writer creates it before querying.
+        if month_range(year, month)[1] > now or not user_dir(user_id).is_dir():
+            continue
+        for fmt in FORMATS:
+            path = cache_path(user_id, kind, year, month, fmt)
+            _bump_generation(path)
+            path.unlink(missing_ok=True)
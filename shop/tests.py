@@ -1,3 +1,997 @@
-from django.test import TestCase
+import copy
+import csv
+import io
+import os
+import tempfile
+from datetime import timedelta
+from functools import partial
+import uuid
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import engines
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import analytics, dashboard, idempotency, inventory, reaper, statements, views
+from . import urls as shop_urls
+from .admin import ProductPurchaseAdmin
+from .management.commands.import_budget import eager_imports, measure_import
+from .models import StripeData, Product, ProductPurchase, ProductSalesRollup
+from .paginators import EstimatedCountPaginator
+from .template_warmup import shop_template_names, warm_templates
+
+
+class ImportTimeBudgetTests(SimpleTestCase):
+    def test_startup_does_not_import_lazy_modules(self):
+        for module in ["niki_shop.wsgi", "niki_shop.asgi"]:
+            _, imports = measure_import(module)
+            names = {name for _, name in imports}
+            self.assertIn("shop.views", names)
+            self.assertEqual(eager_imports(imports), [], module)
+
+    # Wall-clock timing depends on the machine, only checked when asked for.
+    @skipUnless(os.environ.get("SHOP_CHECK_IMPORT_TIME"), "set SHOP_CHECK_IMPORT_TIME=1")
+    def test_entry_points_import_within_budget(self):
+        call_command("import_budget", stdout=StringIO())
+
+
+def cached_loader_templates():
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]["APP_DIRS"] = False
+    templates[0]["OPTIONS"]["loaders"] = [
+        (
+            "django.template.loaders.cached.Loader",
+            [
+                "django.template.loaders.filesystem.Loader",
+                "django.template.loaders.app_directories.Loader",
+            ],
+        ),
+    ]
+    return templates
+
+
+class TemplateWarmupTests(SimpleTestCase):
+    def test_warm_templates_fills_the_cached_loader(self):
+        with override_settings(TEMPLATES=cached_loader_templates()):
+            loader = engines["django"].engine.template_loaders[0]
+            self.assertEqual(loader.get_template_cache, {})
+
+            timings = warm_templates()
+
+            names = shop_template_names()
+            self.assertIn("shop/home.html", names)
+            self.assertEqual(sorted(timings), names)
+            self.assertLessEqual(set(names), set(loader.get_template_cache))
+
+    def test_ready_warms_templates_when_enabled(self):
+        config = django_apps.get_app_config("shop")
+        with mock.patch("shop.template_warmup.warm_templates") as warm:
+            config.ready()
+            warm.assert_not_called()
+            with override_settings(SHOP_WARM_TEMPLATES=True):
+                config.ready()
+        warm.assert_called_once_with()
+
+    def test_template_timings_command(self):
+        out = StringIO()
+        with override_settings(TEMPLATES=cached_loader_templates()):
+            call_command("template_timings", "--repeat", "1", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn("compile ms", lines[0])
+        self.assertEqual([line.split()[0] for line in lines[1:]], shop_template_names())
+
+
+def mock_stripe():
+    stripe = mock.MagicMock()
+    stripe.Account.retrieve.return_value.id = "acct_test"
+    stripe.checkout.Session.create.return_value.url = "https://checkout.stripe.test/"
+    return stripe
+
+
+def stripe_api_calls(stripe):
+    # Calls made on returned objects (templates call mock attributes) are not requests.
+    return len([name for name, _, _ in stripe.mock_calls if "()" not in name])
+
+
+class CheckoutIdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create(username="seller", email="seller@example.com")
+        StripeData.objects.create(user=seller, stripe_id="acct_seller")
+        self.buyer = User.objects.create(username="buyer", email="buyer@example.com")
+        self.product = Product.objects.create(
+            user=seller, name="p", description="", price=1, currency="usd", total_quantity=3
+        )
+        session = self.client.session
+        session["user_id"] = self.buyer.id
+        session.save()
+        self.url = reverse("detail_product", args=[self.product.id])
+        self.stripe = mock_stripe()
+        patcher = mock.patch("shop.views.get_stripe", return_value=self.stripe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("shop.payments.get_stripe", return_value=self.stripe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pay(self, quantity=2, token="token"):
+        return self.client.post(self.url, {"total_quantity": quantity, "idempotency_key": token})
+
+    def test_double_submit_opens_one_checkout(self):
+        first = self.pay()
+        second = self.pay()
+
+        self.assertEqual(first.url, "https://checkout.stripe.test/")
+        self.assertEqual(second.url, first.url)
+        self.assertEqual(self.stripe.checkout.Session.create.call_count, 1)
+        self.assertEqual(ProductPurchase.objects.count(), 1)
+        self.assertEqual(inventory.get_stock(self.product.id), 1)
+
+    def test_retry_after_stripe_failure_reuses_the_purchase(self):
+        create = self.stripe.checkout.Session.create
+        create.side_effect = [Exception("timeout"), create.return_value]
+
+        failed = self.pay()
+        # The first purchase reserved 2 of 3, a new purchase of 2 would not validate.
+        retried = self.pay()
+
+        self.assertContains(failed, "timeout")
+        self.assertEqual(retried.status_code, 302)
+        self.assertEqual(ProductPurchase.objects.count(), 1)
+        self.assertEqual(inventory.get_stock(self.product.id), 1)
+        first_call, second_call = create.call_args_list
+        self.assertEqual(first_call, second_call)
+
+    def test_resubmit_while_stripe_is_called_waits(self):
+        create = self.stripe.checkout.Session.create
+        checkout = create.return_value
+        resubmitted = []
+
+        def open_session(**kwargs):
+            resubmitted.append(self.pay())
+            return checkout
+
+        create.side_effect = open_session
+        # Give up waiting at once instead of after two seconds.
+        with mock.patch("shop.idempotency.result", partial(idempotency.result, wait=0)):
+            first = self.pay()
+
+        self.assertEqual(first.url, "https://checkout.stripe.test/")
+        self.assertContains(resubmitted[0], "already being processed")
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(self.pay().url, first.url)
+
+    def test_new_form_starts_a_new_purchase(self):
+        self.pay(quantity=1, token="first")
+        self.pay(quantity=1, token="second")
+
+        self.assertEqual(ProductPurchase.objects.count(), 2)
+        self.assertEqual(self.stripe.checkout.Session.create.call_count, 2)
+
+
+class ReaperTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user", email="user@example.com")
+        self.first = Product.objects.create(user=self.user, name="first", description="", total_quantity=0)
+        self.second = Product.objects.create(user=self.user, name="second", description="", total_quantity=5)
+
+    def purchase(self, product, quantity, age=timedelta(days=2), **fields):
+        purchase = ProductPurchase.objects.create(
+            buyer=self.user, product=product, quantity=quantity, **fields
+        )
+        ProductPurchase.objects.filter(id=purchase.id).update(
+            date_purchased=timezone.now() - age
+        )
+        return purchase
+
+    def test_reaps_stale_purchases_in_chunks(self):
+        stale = [
+            self.purchase(self.first, 1),
+            self.purchase(self.first, 2),
+            self.purchase(self.second, 3),
+            self.purchase(self.first, 4),
+            self.purchase(self.second, 1),
+        ]
+        fresh = self.purchase(self.second, 7, age=timedelta(minutes=5))
+        completed = self.purchase(self.second, 9, completed=True)
+        expired = self.purchase(self.second, 11, expired=True)
+
+        with mock.patch("shop.reaper.reap_chunk", wraps=reaper.reap_chunk) as reap_chunk:
+            call_command("reap_checkouts", "--batch-size", "2", stdout=StringIO())
+
+        self.assertEqual(reap_chunk.call_count, 3)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.total_quantity, 7)
+        self.assertEqual(self.second.total_quantity, 9)
+        self.assertEqual(
+            set(ProductPurchase.objects.filter(expired=True).values_list("id", flat=True)),
+            {purchase.id for purchase in stale} | {expired.id},
+        )
+        fresh.refresh_from_db()
+        completed.refresh_from_db()
+        self.assertFalse(fresh.expired or completed.expired)
+
+    def test_nothing_to_reap(self):
+        self.purchase(self.first, 1, age=timedelta(minutes=5))
+        self.assertEqual(reaper.reap_expired_purchases(timezone.now() - timedelta(hours=1)), 0)
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # The test cache is local memory, which counter_cache() refuses.
+        patcher = mock.patch("shop.inventory.counter_cache", return_value=cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username="user", email="user@example.com")
+        self.product = Product.objects.create(user=self.user, name="p", description="", total_quantity=5)
+        self.other = Product.objects.create(user=self.user, name="o", description="", total_quantity=5)
+
+    def total_quantity(self, product):
+        product.refresh_from_db()
+        return product.total_quantity
+
+    def test_reserve_takes_stock_from_the_counter(self):
+        inventory.reserve(self.product.id, 2)
+
+        self.assertEqual(inventory.get_stock(self.product.id), 3)
+        self.assertEqual(self.total_quantity(self.product), 5)
+
+    def test_refuses_to_oversell(self):
+        inventory.reserve(self.product.id, 2)
+
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve(self.product.id, 4)
+        self.assertEqual(inventory.get_stock(self.product.id), 3)
+        inventory.reserve(self.product.id, 3)
+        self.assertEqual(inventory.get_stock(self.product.id), 0)
+
+    def test_reload_during_a_reservation_does_not_oversell(self):
+        mark_dirty = inventory._mark_dirty
+        reloaded = []
+
+        def forget_first(cache, product_id):
+            # The product is edited and shown to another buyer between the
+            # two steps of the reservation.
+            inventory.forget(product_id)
+            reloaded.append(inventory.get_stock(product_id))
+            mark_dirty(cache, product_id)
+
+        with mock.patch("shop.inventory._mark_dirty", side_effect=forget_first):
+            inventory.reserve(self.product.id, 2)
+            inventory.reserve(self.product.id, 1)
+
+        # Reloads already count the reservation in progress.
+        self.assertEqual(reloaded, [3, 2])
+        self.assertLessEqual(inventory.get_stock(self.product.id), 2)
+        inventory.flush(all_products=True)
+        inventory.forget(self.product.id)
+        self.assertEqual(inventory.get_stock(self.product.id), 2)
+        self.assertEqual(self.total_quantity(self.product), 2)
+
+    def test_forgotten_right_before_taking_the_counter(self):
+        mark_dirty = inventory._mark_dirty
+
+        def forget_first(cache, product_id):
+            inventory.forget(product_id)
+            mark_dirty(cache, product_id)
+
+        with mock.patch("shop.inventory._mark_dirty", side_effect=forget_first):
+            inventory.reserve(self.product.id, 2)
+            with self.assertRaises(inventory.OutOfStock):
+                inventory.reserve(self.product.id, 4)
+
+        self.assertEqual(inventory.get_stock(self.product.id), 3)
+        inventory.flush(all_products=True)
+        self.assertEqual(self.total_quantity(self.product), 3)
+
+    def test_refused_reservation_flushed_meanwhile_is_undone(self):
+        inventory.reserve(self.product.id, 2)
+        mark_dirty = inventory._mark_dirty
+
+        def flush_after(cache, product_id):
+            mark_dirty(cache, product_id)
+            inventory.flush(all_products=True)
+
+        with mock.patch("shop.inventory._mark_dirty", side_effect=flush_after):
+            with self.assertRaises(inventory.OutOfStock):
+                inventory.reserve(self.product.id, 4)
+        self.assertEqual(self.total_quantity(self.product), -1)
+
+        inventory.flush(all_products=True)
+        self.assertEqual(self.total_quantity(self.product), 3)
+        self.assertEqual(inventory.get_stock(self.product.id), 3)
+
+    def test_flush_writes_only_dirty_products(self):
+        # The first run has no position yet and checks every product.
+        self.assertEqual(inventory.flush(), 0)
+        inventory.reserve(self.product.id, 2)
+        inventory.reserve(self.product.id, 1)
+
+        with mock.patch(
+            "shop.inventory._flush_products", wraps=inventory._flush_products
+        ) as flush_products:
+            self.assertEqual(inventory.flush(batch_size=1), 1)
+            self.assertEqual(inventory.flush(), 0)
+
+        # One batch per sale, nothing left for the second run.
+        self.assertEqual(
+            [call.args[1] for call in flush_products.call_args_list],
+            [{self.product.id}, {self.product.id}],
+        )
+        self.assertEqual(self.total_quantity(self.product), 2)
+        self.assertEqual(self.total_quantity(self.other), 5)
+        inventory.forget(self.product.id)
+        self.assertEqual(inventory.get_stock(self.product.id), 2)
+
+    def test_flush_skips_products_being_loaded(self):
+        inventory.flush()
+        inventory.reserve(self.product.id, 2)
+        cache.add(inventory.lock_key(self.product.id), 1)
+
+        self.assertEqual(inventory.flush(), 0)
+        self.assertEqual(self.total_quantity(self.product), 5)
+        cache.delete(inventory.lock_key(self.product.id))
+        self.assertEqual(inventory.flush(), 1)
+        self.assertEqual(self.total_quantity(self.product), 3)
+
+    def test_reaper_keeps_the_counter_consistent(self):
+        purchase = ProductPurchase.objects.create(buyer=self.user, product=self.product, quantity=2)
+        ProductPurchase.objects.filter(id=purchase.id).update(
+            date_purchased=timezone.now() - timedelta(days=2)
+        )
+        inventory.reserve(self.product.id, 2)
+        inventory.reserve(self.product.id, 1)
+
+        reaper.reap_expired_purchases(timezone.now() - timedelta(days=1))
+
+        self.assertEqual(inventory.get_stock(self.product.id), 4)
+        inventory.flush(all_products=True)
+        self.assertEqual(self.total_quantity(self.product), 4)
+        self.assertEqual(inventory.get_stock(self.product.id), 4)
+
+
+class InventoryWithoutSharedCacheTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="user", email="user@example.com")
+        self.product = Product.objects.create(user=user, name="p", description="", total_quantity=5)
+
+    def test_stock_is_kept_in_the_database(self):
+        inventory.reserve(self.product.id, 2)
+
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve(self.product.id, 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.total_quantity, 3)
+        self.assertEqual(inventory.get_stock(self.product.id), 3)
+        self.assertEqual(inventory.flush(), 0)
+
+    def test_shared_general_purpose_and_local_caches_are_refused(self):
+        local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        for alias, caches_setting in [
+            ("default", {"default": local}),
+            ("inventory", {"default": local, "inventory": local}),
+            ("inventory", {"default": local, "inventory": {**local, "LOCATION": "inventory"}}),
+        ]:
+            with self.subTest(caches_setting), override_settings(
+                CACHES=caches_setting, SHOP_INVENTORY_CACHE=alias
+            ):
+                with self.assertRaises(ImproperlyConfigured):
+                    inventory.counter_cache()
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.buyer = User.objects.create(username="buyer", email="buyer@example.com")
+        self.first = Product.objects.create(user=self.seller, name="first", description="", price=2.5)
+        self.second = Product.objects.create(user=self.seller, name="second", description="", price=10)
+        self.purchases = [
+            self.purchase(self.first, 1, "2024-03-01T10:15"),
+            self.purchase(self.first, 2, "2024-03-01T10:45"),
+            self.purchase(self.first, 4, "2024-03-01T11:05"),
+            self.purchase(self.second, 1, "2024-03-01T10:20"),
+            self.purchase(self.first, 3, "2024-03-02T09:00"),
+            self.purchase(self.first, 5, "2024-04-01T00:30"),
+        ]
+        self.pending = self.purchase(self.first, 100, "2024-03-01T10:30")
+        for purchase in self.purchases:
+            self.complete(purchase)
+
+    def purchase(self, product, quantity, moment):
+        purchase = ProductPurchase.objects.create(
+            buyer=self.buyer, product=product, quantity=quantity, product_price=product.price
+        )
+        ProductPurchase.objects.filter(id=purchase.id).update(date_purchased=self.moment(moment))
+        return purchase
+
+    def moment(self, value):
+        return views.parse_moment(value)
+
+    def complete(self, purchase):
+        views.handle_completed_checkout_session(
+            mock.Mock(metadata={"purchase_id": str(purchase.id)})
+        )
+
+    def rollups(self):
+        return {
+            (row.product_id, row.period, row.bucket.isoformat()): (row.quantity, row.revenue)
+            for row in ProductSalesRollup.objects.all()
+        }
+
+    def test_buckets(self):
+        hour, day, month = ProductSalesRollup.HOUR, ProductSalesRollup.DAY, ProductSalesRollup.MONTH
+        first, second = self.first.id, self.second.id
+        self.assertEqual(
+            self.rollups(),
+            {
+                (first, hour, "2024-03-01T10:00:00+00:00"): (3, 7.5),
+                (first, hour, "2024-03-01T11:00:00+00:00"): (4, 10.0),
+                (first, hour, "2024-03-02T09:00:00+00:00"): (3, 7.5),
+                (first, hour, "2024-04-01T00:00:00+00:00"): (5, 12.5),
+                (second, hour, "2024-03-01T10:00:00+00:00"): (1, 10.0),
+                (first, day, "2024-03-01T00:00:00+00:00"): (7, 17.5),
+                (first, day, "2024-03-02T00:00:00+00:00"): (3, 7.5),
+                (first, day, "2024-04-01T00:00:00+00:00"): (5, 12.5),
+                (second, day, "2024-03-01T00:00:00+00:00"): (1, 10.0),
+                (first, month, "2024-03-01T00:00:00+00:00"): (10, 25.0),
+                (first, month, "2024-04-01T00:00:00+00:00"): (5, 12.5),
+                (second, month, "2024-03-01T00:00:00+00:00"): (1, 10.0),
+            },
+        )
+
+    def test_repeated_webhook_is_counted_once(self):
+        before = self.rollups()
+        self.complete(self.purchases[0])
+        self.assertEqual(self.rollups(), before)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        incremental = self.rollups()
+        analytics.rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    @override_settings(TIME_ZONE="America/New_York")
+    def test_buckets_follow_the_time_zone(self):
+        ProductSalesRollup.objects.all().delete()
+        analytics.record_sales(ProductPurchase.objects.filter(completed=True))
+        incremental = self.rollups()
+        self.assertIn(
+            (self.first.id, ProductSalesRollup.DAY, "2024-03-01T05:00:00+00:00"), incremental
+        )
+        analytics.rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_range_starts_at_the_bucket_and_excludes_the_end(self):
+        sales = analytics.seller_sales(
+            self.seller,
+            ProductSalesRollup.HOUR,
+            self.moment("2024-03-01T10:30"),
+            self.moment("2024-03-01T11:00"),
+        )
+        self.assertEqual(
+            [(row["product_id"], row["bucket"].hour, row["quantity"]) for row in sales],
+            [(self.first.id, 10, 3), (self.second.id, 10, 1)],
+        )
+
+        sales = analytics.seller_sales(
+            self.seller,
+            ProductSalesRollup.DAY,
+            self.moment("2024-03-02T12:00"),
+            self.moment("2024-04-01"),
+        )
+        self.assertEqual([(row["bucket"].day, row["quantity"]) for row in sales], [(2, 3)])
+
+    def test_view(self):
+        session = self.client.session
+        session["user_id"] = self.seller.id
+        session.save()
+        url = reverse("sales_analytics")
+
+        response = self.client.get(url, {"period": "month", "start": "2024-03-01", "end": "2024-05-01"})
+        self.assertEqual(
+            [(row["product_name"], row["quantity"], row["revenue"]) for row in response.json()["sales"]],
+            [("first", 10, 25.0), ("second", 1, 10.0), ("first", 5, 12.5)],
+        )
+        self.assertEqual(self.client.get(url, {"period": "week"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"start": "March"}).status_code, 400)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="user", email="user@example.com")
+        for name in "abc":
+            Product.objects.create(user=user, name=name, description="", currency="usd")
+
+    def fake_postgresql(self, estimate):
+        connection = mock.MagicMock(vendor="postgresql")
+        connection.cursor.return_value.__enter__.return_value.fetchone.return_value = (estimate,)
+        return mock.patch("shop.paginators.connections", {"default": connection})
+
+    def test_counts_small_tables(self):
+        self.assertEqual(EstimatedCountPaginator(Product.objects.order_by("id"), 2).count, 3)
+        with self.fake_postgresql(50.0):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.order_by("id"), 2).count, 3)
+
+    @override_settings(SHOP_ESTIMATED_COUNT_THRESHOLD=100)
+    def test_uses_the_estimate_for_big_unfiltered_tables(self):
+        with self.fake_postgresql(250000.0):
+            paginator = EstimatedCountPaginator(Product.objects.order_by("id"), 2)
+            self.assertEqual(paginator.count, 250000)
+            filtered = EstimatedCountPaginator(Product.objects.filter(currency="usd").order_by("id"), 2)
+            self.assertEqual(filtered.count, 3)
+
+    @override_settings(SHOP_ESTIMATED_COUNT_THRESHOLD=2)
+    def test_sqlite_estimates_with_the_highest_id(self):
+        Product.objects.order_by("id").first().delete()
+        highest = Product.objects.order_by("-id").values_list("id", flat=True).first()
+
+        with CaptureQueriesContext(connection) as queries:
+            count = EstimatedCountPaginator(Product.objects.order_by("id"), 2).count
+        self.assertEqual(count, highest)
+        self.assertNotIn("COUNT", queries[0]["sql"])
+        filtered = EstimatedCountPaginator(Product.objects.filter(currency="usd").order_by("id"), 2)
+        self.assertEqual(filtered.count, 2)
+
+
+class AdminActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+        self.buyer = User.objects.create(username="buyer", email="buyer@example.com")
+        self.product = Product.objects.create(
+            user=self.buyer, name="p", description="", price=2, total_quantity=10
+        )
+
+    def act(self, model, action, objects, **data):
+        url = reverse(f"admin:shop_{model}_changelist")
+        data.update(action=action, _selected_action=[obj.id for obj in objects])
+        return self.client.post(url, data, follow=True)
+
+    def purchase(self, quantity, **fields):
+        return ProductPurchase.objects.create(
+            buyer=self.buyer, product=self.product, quantity=quantity, product_price=2, **fields
+        )
+
+    def test_changelists(self):
+        self.purchase(1)
+        for model in ["product", "productpurchase", "stripedata"]:
+            response = self.client.get(reverse(f"admin:shop_{model}_changelist"))
+            self.assertEqual(response.status_code, 200, model)
+
+    def test_set_price(self):
+        other = Product.objects.create(user=self.buyer, name="o", description="", price=2)
+
+        self.act("product", "set_price", [self.product], price="7.5")
+        response = self.act("product", "set_price", [other], price="")
+
+        self.assertContains(response, "Enter a valid price")
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.price, other.price), (7.5, 2))
+
+    def test_mark_completed_in_chunks(self):
+        pending = [self.purchase(1), self.purchase(2), self.purchase(3)]
+        expired = self.purchase(4, expired=True)
+        completed = self.purchase(5, completed=True)
+        analytics.record_sales([completed])
+
+        with mock.patch.object(ProductPurchaseAdmin, "complete_batch_size", 2), mock.patch.object(
+            ProductPurchaseAdmin, "complete_chunk", autospec=True, side_effect=ProductPurchaseAdmin.complete_chunk
+        ) as complete_chunk:
+            response = self.act("productpurchase", "mark_completed", pending + [expired, completed])
+
+        self.assertContains(response, "Marked 4 purchases as completed")
+        self.assertEqual(complete_chunk.call_count, 3)
+        self.assertEqual(ProductPurchase.objects.filter(completed=False).count(), 0)
+        self.assertFalse(ProductPurchase.objects.filter(expired=True).exists())
+        self.product.refresh_from_db()
+        # Only the expired purchase had given its stock back.
+        self.assertEqual(self.product.total_quantity, 6)
+        month = ProductSalesRollup.objects.get(period=ProductSalesRollup.MONTH)
+        self.assertEqual((month.quantity, month.revenue), (15, 30.0))
+
+    def test_mark_completed_skips_purchases_completed_meanwhile(self):
+        purchase = self.purchase(1)
+        # The webhook completed it after the changelist was shown.
+        views.handle_completed_checkout_session(mock.Mock(metadata={"purchase_id": str(purchase.id)}))
+
+        response = self.act("productpurchase", "mark_completed", [purchase])
+
+        self.assertContains(response, "Marked 0 purchases as completed")
+        month = ProductSalesRollup.objects.get(period=ProductSalesRollup.MONTH)
+        self.assertEqual(month.quantity, 1)
+
+
+class StatementTests(TestCase):
+    def setUp(self):
+        statements_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(statements_dir.cleanup)
+        overrides = override_settings(SHOP_STATEMENTS_DIR=statements_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.buyer = User.objects.create(
+            username="buyer", email="buyer@example.com", first_name="Ann", last_name="Buyer"
+        )
+        self.product = Product.objects.create(user=self.seller, name="lamp", description="", price=2.5)
+        self.other = Product.objects.create(user=self.buyer, name="chair", description="", price=10)
+        self.purchase(self.product, 2, "2024-03-01T10:00")
+        self.purchase(self.other, 1, "2024-03-05T12:30")
+        self.purchase(self.product, 1, "2024-04-01T00:00")
+        self.pending = self.purchase(self.product, 9, "2024-03-10T08:00", completed=False)
+        self.login(self.buyer)
+
+    def purchase(self, product, quantity, moment, completed=True):
+        purchase = ProductPurchase.objects.create(
+            buyer=self.buyer,
+            product=product,
+            quantity=quantity,
+            product_name=product.name,
+            product_price=product.price,
+            product_currency="usd",
+            completed=completed,
+        )
+        ProductPurchase.objects.filter(id=purchase.id).update(date_purchased=views.parse_moment(moment))
+        purchase.refresh_from_db()
+        return purchase
+
+    def login(self, user):
+        session = self.client.session
+        session["user_id"] = user.id
+        session.save()
+
+    def get(self, kind, year=2024, month=3, fmt="csv"):
+        url = reverse("monthly_statement", args=[kind, year, month])
+        response = self.client.get(url, {"format": fmt})
+        if response.status_code != 200:
+            return response, None
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_receipts_csv(self):
+        response, content = self.get("receipts")
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="receipts-2024-03.csv"', response["Content-Disposition"])
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], statements.HEADER)
+        self.assertEqual(
+            [(row[1], row[3], row[4], row[6]) for row in rows[1:]],
+            [("2024-03-01T10:00:00+00:00", "lamp", "2", "5.0"), ("2024-03-05T12:30:00+00:00", "chair", "1", "10.0")],
+        )
+
+    def test_payouts_text(self):
+        self.login(self.seller)
+        response, content = self.get("payouts", fmt="txt")
+
+        self.assertEqual(response["Content-Type"], "text/plain")
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "Niki's Shop - Payout statement")
+        self.assertEqual(lines[2], "2024-03-01 - 2024-04-01")
+        self.assertEqual(len([line for line in lines if "lamp" in line]), 1)
+        self.assertNotIn("chair", content)
+        self.assertEqual(lines[-1], "Total usd: 5.00")
+
+    def test_date_range_statement(self):
+        response = self.client.get(
+            reverse("statement", args=["receipts"]),
+            {"start": "2024-03-02", "end": "2024-04-02", "format": "csv"},
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual([row[3] for row in csv.reader(io.StringIO(content))][1:], ["chair", "lamp"])
+
+    def test_finished_months_are_served_from_disk(self):
+        _, first = self.get("receipts")
+        path = statements.cache_path(self.buyer.id, "receipts", 2024, 3, "csv")
+        self.assertEqual(path.read_bytes().decode(), first)
+
+        with mock.patch("shop.statements.generate") as generate:
+            _, second = self.get("receipts")
+        generate.assert_not_called()
+        self.assertEqual(second, first)
+
+    def test_current_month_is_not_stored(self):
+        now = timezone.localtime()
+        self.get("receipts", now.year, now.month)
+        self.assertFalse(statements.cache_path(self.buyer.id, "receipts", now.year, now.month, "csv").exists())
+
+    def test_completion_invalidates_the_month(self):
+        self.get("receipts")
+        self.login(self.seller)
+        self.get("payouts")
+        self.login(self.buyer)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            views.handle_completed_checkout_session(mock.Mock(metadata={"purchase_id": str(self.pending.id)}))
+
+        for user, kind in [(self.buyer, "receipts"), (self.seller, "payouts")]:
+            self.assertFalse(statements.cache_path(user.id, kind, 2024, 3, "csv").exists(), kind)
+        _, content = self.get("receipts")
+        self.assertEqual(content.count("lamp"), 2)
+
+    def test_invalidation_skips_current_months_and_users_without_statements(self):
+        self.get("receipts")
+        now = timezone.localtime()
+        current = self.purchase(self.product, 1, now.isoformat(), completed=False)
+
+        statements.invalidate([self.pending, current])
+
+        self.assertEqual(
+            sorted(path.name for path in Path(settings.SHOP_STATEMENTS_DIR).rglob("*")),
+            [
+                str(self.buyer.id),
+                "2024-03-receipts.csv.generation",
+                "2024-03-receipts.txt.generation",
+            ],
+        )
+
+    def test_invalidation_during_generation_is_not_lost(self):
+        user = User.objects.get(id=self.buyer.id)
+        lines = statements.monthly_statement(user, "receipts", 2024, 3, "csv")
+        next(lines)
+        statements.invalidate([self.pending])
+        list(lines)
+
+        self.assertFalse(statements.cache_path(user.id, "receipts", 2024, 3, "csv").exists())
+        list(statements.monthly_statement(user, "receipts", 2024, 3, "csv"))
+        self.assertTrue(statements.cache_path(user.id, "receipts", 2024, 3, "csv").exists())
+
+    def test_unknown_statements(self):
+        for kind, year, month, fmt in [
+            ("refunds", 2024, 3, "csv"),
+            ("receipts", 2024, 3, "pdf"),
+            ("receipts", 2024, 13, "csv"),
+            ("receipts", 0, 1, "csv"),
+            ("receipts", 10000, 1, "csv"),
+            ("receipts", 9999, 12, "csv"),
+        ]:
+            response, _ = self.get(kind, year, month, fmt)
+            self.assertEqual(response.status_code, 404, (kind, year, month, fmt))
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user", email="user@example.com")
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.product = Product.objects.create(user=self.seller, name="lamp", description="", price=1)
+        patcher = mock.patch("shop.dashboard.get_stripe_account", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        session = self.client.session
+        session["user_id"] = self.user.id
+        session.save()
+
+    def test_home_is_served_from_the_warm_cache(self):
+        dashboard.get_dashboard(self.user)
+
+        with mock.patch("shop.dashboard.build_dashboard") as build_dashboard:
+            response = self.client.get(reverse("home"))
+
+        build_dashboard.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+
+    def test_others_products_are_not_cached(self):
+        dashboard.get_dashboard(self.user)
+        Product.objects.create(user=self.seller, name="chair", description="")
+
+        self.assertNotIn("others_products", cache.get(dashboard.dashboard_key(self.user.id))[1])
+        names = [product.name for product in dashboard.get_dashboard(self.user)["others_products"]]
+        self.assertEqual(sorted(names), ["chair", "lamp"])
+
+    @override_settings(SHOP_DASHBOARD_PURCHASES=3)
+    def test_purchase_lists_are_bounded(self):
+        for quantity in range(1, 6):
+            ProductPurchase.objects.create(
+                buyer=self.user, product=self.product, product_name="lamp", quantity=quantity
+            )
+
+        data = dashboard.get_dashboard(self.user)
+        self.assertEqual([row["quantity"] for row in data["purchased_products"]], [5, 4, 3])
+        self.assertEqual(len(dashboard.get_dashboard(self.seller)["sell_products"]), 3)
+        self.assertEqual(set(data["purchased_products"][0]), set(dashboard.PURCHASE_FIELDS))
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_warm_up_racing_forget_is_not_served(self):
+        def build(user):
+            # The user buys something while their dashboard is being built.
+            dashboard.forget(user.id)
+            return {"my_products": []}
+
+        with mock.patch("shop.dashboard.build_dashboard", side_effect=build):
+            dashboard._store(self.user)
+
+        with mock.patch("shop.dashboard.build_dashboard", return_value={}) as build_dashboard:
+            dashboard.get_dashboard(self.user)
+        build_dashboard.assert_called_once()
+
+    def test_completed_checkout_forgets_buyer_and_seller(self):
+        purchase = ProductPurchase.objects.create(buyer=self.user, product=self.product, quantity=1)
+        dashboard.get_dashboard(self.user)
+        dashboard.get_dashboard(self.seller)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            views.handle_completed_checkout_session(mock.Mock(metadata={"purchase_id": str(purchase.id)}))
+
+        self.assertIsNone(dashboard._cached(self.user.id))
+        self.assertIsNone(dashboard._cached(self.seller.id))
+
+
+class DashboardPrefetchTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user", email="user@example.com")
+        self.user.set_password("password")
+        self.user.save()
+        patcher = mock.patch("shop.dashboard.get_stripe_account", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_login_warms_the_dashboard(self):
+        futures = []
+        prefetch = dashboard.prefetch
+
+        def track(user_id):
+            futures.append(prefetch(user_id))
+            return futures[-1]
+
+        with mock.patch("shop.dashboard.prefetch", side_effect=track):
+            response = self.client.post(
+                reverse("login"), {"email": "user@example.com", "password": "password"}
+            )
+        self.assertRedirects(response, reverse("home"), fetch_redirect_response=False)
+        self.assertEqual(len(futures), 1)
+        futures[0].result(timeout=5)
+
+        self.assertIsNotNone(dashboard._cached(self.user.id))
+        with mock.patch("shop.dashboard.build_dashboard") as build_dashboard:
+            self.assertEqual(self.client.get(reverse("home")).status_code, 200)
+        build_dashboard.assert_not_called()
+
+
+class ViewQueryCountTests(TestCase):
+    """Every shop view must do the same work no matter how much data exists."""
+
+    scales = (1, 10, 40)
+
+    def seed(self, scale):
+        user = User.objects.create(username="user", email="user@example.com")
+        StripeData.objects.create(user=user, stripe_id="acct_user")
+        others = []
+        for i in range(scale):
+            other = User.objects.create(username=f"other{i}", email=f"other{i}@example.com")
+            StripeData.objects.create(user=other, stripe_id=f"acct_other{i}")
+            others.append(other)
+
+        own_products = [
+            Product.objects.create(
+                user=user, name=f"own{i}", description="", price=1, currency="usd", total_quantity=100
+            )
+            for i in range(scale)
+        ]
+        other_products = [
+            Product.objects.create(
+                user=other, name=f"other{i}", description="", price=1, currency="usd", total_quantity=100
+            )
+            for i, other in enumerate(others)
+        ]
+        purchases = []
+        for own, other_product, other in zip(own_products, other_products, others):
+            purchases.append(ProductPurchase.objects.create(buyer=other, product=own, quantity=1))
+            purchases.append(ProductPurchase.objects.create(buyer=user, product=other_product, quantity=1))
+        ProductPurchase.objects.exclude(id=purchases[0].id).update(completed=True)
+        analytics.record_sales(purchases)
+
+        return {
+            "user": user,
+            "own_product": own_products[0],
+            "other_product": other_products[0],
+            "purchase": purchases[0],
+        }
+
+    def requests(self, data):
+        own_id = data["own_product"].id
+        now = timezone.now()
+        other_id = data["other_product"].id
+        # logout and delete_product change what the later requests see, keep them last.
+        return [
+            ("index", "get", reverse("index"), None),
+            ("register", "get", reverse("register"), None),
+            ("login", "get", reverse("login"), None),
+            ("home", "get", reverse("home"), None),
+            ("register_in_stripe", "get", reverse("register_in_stripe"), None),
+            ("create_product", "get", reverse("create_product"), None),
+            ("edit_product", "get", reverse("edit_product", args=[own_id]), None),
+            ("detail_product", "get", reverse("detail_product", args=[other_id]), None),
+            (
+                "detail_product POST",
+                "post",
+                reverse("detail_product", args=[other_id]),
+                {"total_quantity": 1, "idempotency_key": uuid.uuid4().hex},
+            ),
+            ("webhook_received", "post", reverse("webhook_received"), {}),
+            ("sales_analytics", "get", reverse("sales_analytics"), {"period": "hour"}),
+            ("statement", "get", reverse("statement", args=["receipts"]), None),
+            ("statement txt", "get", reverse("statement", args=["payouts"]), {"format": "txt"}),
+            (
+                "monthly_statement",
+                "get",
+                reverse("monthly_statement", args=["payouts", now.year, now.month]),
+                None,
+            ),
+            ("delete_product", "get", reverse("delete_product", args=[own_id]), None),
+            ("logout", "get", reverse("logout"), None),
+        ]
+
+    def measure(self, scale):
+        results = {}
+        cache.clear()
+        with tempfile.TemporaryDirectory() as statements_dir, override_settings(
+            SHOP_STATEMENTS_DIR=statements_dir
+        ), transaction.atomic():
+            data = self.seed(scale)
+            self.client.cookies.clear()
+            session = self.client.session
+            session["user_id"] = data["user"].id
+            session.save()
+
+            for name, method, url, payload in self.requests(data):
+                stripe = mock_stripe()
+                event = stripe.Webhook.construct_event.return_value
+                event.type = "checkout.session.completed"
+                event.data.object.metadata.get.return_value = data["purchase"].id
+                with mock.patch("shop.views.get_stripe", return_value=stripe), mock.patch(
+                    "shop.payments.get_stripe", return_value=stripe
+                ), CaptureQueriesContext(connection) as queries:
+                    response = getattr(self.client, method)(url, payload)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                self.assertLess(response.status_code, 400, f"{name} failed at scale {scale}")
+                results[name] = (
+                    [query["sql"] for query in queries.captured_queries],
+                    stripe_api_calls(stripe),
+                )
+            transaction.set_rollback(True)
+        return results
+
+    def test_every_shop_url_is_requested(self):
+        data = self.seed(1)
+        requested = {resolve(url).url_name for _, _, url, _ in self.requests(data)}
+        self.assertEqual(requested, {pattern.name for pattern in shop_urls.urlpatterns})
+
+    def test_query_and_stripe_call_counts_do_not_grow_with_data(self):
+        results = {scale: self.measure(scale) for scale in self.scales}
+        smallest = results[self.scales[0]]
+        self.assertEqual(smallest["home"][1], 1, "home should fetch the Stripe account once")
+        for scale in self.scales[1:]:
+            for name, (queries, stripe_calls) in results[scale].items():
+                expected_queries, expected_stripe_calls = smallest[name]
+                with self.subTest(view=name, scale=scale):
+                    self.assertEqual(
+                        len(queries),
+                        len(expected_queries),
+                        "{} ran {} queries with {} products, {} with {}:\n{}".format(
+                            name,
+                            len(queries),
+                            scale,
+                            len(expected_queries),
+                            self.scales[0],
+                            "\n".join(f"  {sql}" for sql in queries),
+                        ),
+                    )
+                    self.assertEqual(stripe_calls, expected_stripe_calls)
@@ -11,6 +11,13 @@ urlpatterns = [
     path("create_stripe_account/", views.register_in_stripe, name="register_in_stripe"),
     path("create/new/product/", views.create_product, name="create_product"),
     path("webhook/", views.webhook_received, name="webhook_received"),
+    path("analytics/sales/", views.sales_analytics, name="sales_analytics"),
+    path("statements/<str:kind>/", views.statement, name="statement"),
+    path(
+        "statements/<str:kind>/<int:year>/<int:month>/",
+        views.monthly_statement,
+        name="monthly_statement",
+    ),
     path("edit/product/<int:product_id>/", views.edit_product, name="edit_product"),
     path(
         "detail/product/<int:product_id>/", views.detail_product, name="detail_product"
@@ -1,19 +1,31 @@
-import stripe
+from datetime import MAXYEAR, MINYEAR, datetime, time, timedelta
 
 from django import forms
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.urls import reverse
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from .forms import (
     RegisterUserForm,
     LoginUserForm,
     ProductForm,
     BuyProductsForm,
 )
-from .models import StripeData, Product, ProductPurchase
+from . import analytics, dashboard, idempotency, inventory, statements
+from .models import StripeData, Product, ProductPurchase, ProductSalesRollup
+from .payments import get_stripe, get_stripe_account
 
 
 def get_session_user(request):
@@ -26,42 +38,8 @@ def get_session_user(request):
 
 
 def check_stripe_id(user):
-    # user = get_session_user(request)
-    try:
-        stripe_data = StripeData.objects.get(user=user)
-        n = stripe.Account.retrieve(stripe_data.stripe_id, settings.STRIPE_SECRET_KEY)
-        stripe_id = n.id
-    except Exception:
-        stripe_id = None
-    return stripe_id
-
-
-def my_products(user):
-    check_stripe_id(user)
-    products = list(user.product_set.all())
-    return products
-
-
-def others_products(user):
-    check_stripe_id(user)
-    products = list(Product.objects.exclude(user=user))
-    return products
-
-
-def purchased_products(user):
-    check_stripe_id(user)
-    products = list(user.buyproducts_set.all())
-    return products
-
-
-def sell_products(user):
-    check_stripe_id(user)
-    products = list()
-    for p in user.product_set.all():
-        for n in p.buyproducts_set.all():
-            if n is not None:
-                products.append(n)
-    return products
+    stripe_account = get_stripe_account(user)
+    return stripe_account.id if stripe_account else None
 
 
 # Create your views here.
@@ -106,51 +84,34 @@ def logout(request):
 
 def home(request):
     user = get_session_user(request)
-    stripe_id = check_stripe_id(user)
-    products_my = my_products(user)
-    products_others = others_products(user)
-    products_purchased = purchased_products(user)
-    products_sell = sell_products(user)
-    stripe_user = stripe.Account.retrieve(stripe_id, settings.STRIPE_SECRET_KEY)
     return render(
         request,
         "shop/home.html",
-        {
-            "user": user,
-            "stripe": stripe_id,
-            "my_products": products_my,
-            "others_products": products_others,
-            "stripe_user": stripe_user,
-            "purchased_products": products_purchased,
-            "sell_products": products_sell,
-        },
+        {"user": user, **dashboard.get_dashboard(user)},
     )
 
 
 def register_in_stripe(request):
     user = get_session_user(request)
-    stripe_id = check_stripe_id(user)
-
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe_user = get_stripe_account(user)
+    stripe = get_stripe()
+    dashboard.forget(user.id)
 
-    if not stripe_id:
+    if not stripe_user:
         try:
-            user_stripe_account = stripe.Account.create(
+            stripe_user = stripe.Account.create(
                 type="standard",
                 country="BG",
                 email=user.email,
             )
-            stripe_id = user_stripe_account.id
 
             messages.success(request, "user_stripe_account")
-            stripe_data = StripeData(user=user, stripe_id=stripe_id)
+            stripe_data = StripeData(user=user, stripe_id=stripe_user.id)
             stripe_data.save()
         except Exception as e:
             messages.error(request, f"Failed to create stripe account got: {e}")
             return redirect("home")
 
-    stripe_user = stripe.Account.retrieve(stripe_id, settings.STRIPE_SECRET_KEY)
-
     if stripe_user.charges_enabled and stripe_user.details_submitted:
         messages.success(request, "You already have an stripe account")
         return redirect("home")
@@ -166,12 +127,12 @@ def register_in_stripe(request):
 
 def create_product(request):
     user = get_session_user(request)
-    check_stripe_id(user)
     form = ProductForm(request.POST or None, user=user)
     if request.method == "POST":
         if form.is_valid():
             try:
                 form.save()
+                dashboard.forget(user.id)
                 messages.success(request, "Your product is Successful created")
                 return redirect("home")
             except Exception as e:
@@ -182,14 +143,14 @@ def create_product(request):
 
 def edit_product(request, product_id):
     user = get_session_user(request)
-    check_stripe_id(user)
     product = get_object_or_404(user.product_set.all(), id=product_id)
 
-    form = ProductForm(request.POST or None, instance=product)
+    form = ProductForm(request.POST or None, instance=product, user=user)
     if request.method == "POST":
         if form.is_valid():
             try:
                 form.save()
+                dashboard.forget(user.id)
                 messages.success(request, "Your product is Successful edited")
                 return redirect("home")
             except Exception as e:
@@ -198,52 +159,106 @@ def edit_product(request, product_id):
     return render(request, "shop/edit_product.html", {"form": form, "product": product})
 
 
+def create_checkout_session(purchase, payer_stripe_id, idempotency_key):
+    product = purchase.product
+    # https://stripe.com/docs/connect/enable-payment-acceptance-guide?platform=web&elements-or-checkout=checkout#web-return-url
+    return get_stripe().checkout.Session.create(
+        stripe_account=payer_stripe_id,
+        line_items=[
+            {
+                "price_data": {
+                    "product_data": {
+                        "name": product.name,
+                        "description": product.description,
+                        "metadata": {"product_id": product.id},
+                    },
+                    "unit_amount": product.price,
+                    "currency": product.currency,
+                },
+                "quantity": purchase.quantity,
+            },
+        ],
+        payment_intent_data={
+            "application_fee_amount": 100,
+        },
+        payment_method_types=[
+            "card",
+        ],
+        metadata={
+            "purchase_id": purchase.id,
+        },
+        mode="payment",
+        success_url=f"http://localhost:8000/shop/success/?purchase_id={purchase.id}",
+        cancel_url="http://localhost:8000/shop/login/",
+        idempotency_key=idempotency_key,
+    )
+
+
+def start_checkout(form, purchase, payer_stripe_id, checkout_key, attempt=0):
+    """Redirect to Stripe checkout for `purchase`, None with a form error if that fails.
+
+    Repeated submissions wait while the key is pending, and only retry
+    once the attempt is marked as failed.
+    """
+    state = {"purchase_id": purchase.id, "attempt": attempt}
+    idempotency.complete(checkout_key, {**state, "pending": True})
+    try:
+        checkout_session = create_checkout_session(purchase, payer_stripe_id, checkout_key)
+    except Exception as e:
+        idempotency.complete(checkout_key, {**state, "failed": True})
+        form.add_error(None, f"Something Unexpected happen: {e}")
+        return None
+
+    idempotency.complete(checkout_key, {**state, "url": checkout_session.url})
+    dashboard.forget(purchase.buyer_id, purchase.product.user_id)
+    return redirect(checkout_session.url, code=303)
+
+
 def detail_product(request, product_id):
     user = get_session_user(request)
-    product = get_object_or_404(Product, id=product_id)
+    product = get_object_or_404(Product.objects.select_related("user"), id=product_id)
+    product.total_quantity = inventory.get_stock(product.id)
     payer_stripe_id = check_stripe_id(product.user)
     can_pay = (user.id != product.user_id) and payer_stripe_id
 
     form = BuyProductsForm(request.POST or None, product=product, user=user)
     if request.method == "POST":
-        if form.is_valid():
-            try:
-                purchase = form.save()
-
-                # https://stripe.com/docs/connect/enable-payment-acceptance-guide?platform=web&elements-or-checkout=checkout#web-return-url
-                checkout_session = stripe.checkout.Session.create(
-                    stripe_account=payer_stripe_id,
-                    line_items=[
-                        {
-                            "price_data": {
-                                "product_data": {
-                                    "name": product.name,
-                                    "description": product.description,
-                                    "metadata": {"product_id": product.id},
-                                },
-                                "unit_amount": product.price,
-                                "currency": product.currency,
-                            },
-                            "quantity": form.cleaned_data["total_quantity"],
-                        },
-                    ],
-                    payment_intent_data={
-                        "application_fee_amount": 100,
-                    },
-                    payment_method_types=[
-                        "card",
-                    ],
-                    metadata={
-                        "purchase_id": purchase.id,
-                    },
-                    mode="payment",
-                    success_url=f"http://localhost:8000/shop/success/?purchase_id={purchase.id}",
-                    cancel_url="http://localhost:8000/shop/login/",
+        checkout_key = form.checkout_key()
+        state = idempotency.result(checkout_key) if checkout_key else None
+        if idempotency.is_pending(state):
+            form.add_error(None, "Your payment is already being processed")
+        elif state and state.get("url"):
+            return redirect(state["url"], code=303)
+        elif state and state.get("failed"):
+            # The purchase exists but opening its checkout failed, retry it
+            # as is. One request claims each retry.
+            attempt = state["attempt"] + 1
+            if not idempotency.claim(f"{checkout_key}:{attempt}"):
+                form.add_error(None, "Your payment is already being processed")
+            else:
+                purchase = get_object_or_404(
+                    ProductPurchase.objects.select_related("product"),
+                    id=state["purchase_id"],
+                    product=product,
                 )
-            except Exception as e:
-                form.add_error(None, f"Something Unexpected happen: {e}")
+                response = start_checkout(form, purchase, payer_stripe_id, checkout_key, attempt)
+                if response:
+                    return response
+        elif form.is_valid():
+            if not idempotency.claim(checkout_key):
+                form.add_error(None, "Your payment is already being processed")
             else:
-                return redirect(checkout_session.url, code=303)
+                try:
+                    purchase = form.save()
+                except Exception as e:
+                    idempotency.release(checkout_key)
+                    form.add_error(None, f"Something Unexpected happen: {e}")
+                else:
+                    response = start_checkout(
+                        form, purchase, payer_stripe_id, checkout_key
+                    )
+                    if response:
+                        return response
 
     return render(
         request,
@@ -256,14 +271,106 @@ def delete_product(request, product_id):
     user = get_session_user(request)
     product = get_object_or_404(user.product_set.all(), id=product_id)
     product.delete()
+    dashboard.forget(user.id)
     messages.success(request, "product has been deleted")
     return redirect("home")
 
 
+def sales_analytics(request):
+    user = get_session_user(request)
+    period = request.GET.get("period", ProductSalesRollup.DAY)
+    if period not in analytics.TRUNCATE:
+        return JsonResponse({"error": f"Unknown period {period}"}, status=400)
+
+    try:
+        end = parse_moment(request.GET.get("end")) or timezone.now()
+        start = parse_moment(request.GET.get("start")) or end - timedelta(days=30)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    sales = analytics.seller_sales(user, period, start, end)
+    return JsonResponse(
+        {
+            "period": period,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "sales": [
+                {
+                    "product_id": row["product_id"],
+                    "product_name": row["product__name"],
+                    "bucket": row["bucket"].isoformat(),
+                    "quantity": row["quantity"],
+                    "revenue": row["revenue"],
+                }
+                for row in sales
+            ],
+        }
+    )
+
+
+def parse_moment(value):
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date {value}")
+        moment = datetime.combine(date, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def statement(request, kind):
+    user = get_session_user(request)
+    fmt = request.GET.get("format", "csv")
+    if kind not in statements.KINDS or fmt not in statements.FORMATS:
+        raise Http404("Unknown statement")
+
+    try:
+        end = parse_moment(request.GET.get("end")) or timezone.now()
+        start = parse_moment(request.GET.get("start")) or end - timedelta(days=30)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+
+    return statement_response(
+        statements.generate(user, kind, start, end, fmt),
+        f"{kind}-{start:%Y%m%d}-{end:%Y%m%d}.{fmt}",
+        fmt,
+    )
+
+
+def monthly_statement(request, kind, year, month):
+    user = get_session_user(request)
+    fmt = request.GET.get("format", "csv")
+    if (
+        kind not in statements.KINDS
+        or fmt not in statements.FORMATS
+        or not 1 <= month <= 12
+        # Keeps month_range() and time zone conversions inside datetime's range.
+        or not MINYEAR < year < MAXYEAR
+    ):
+        raise Http404("Unknown statement")
+
+    return statement_response(
+        statements.monthly_statement(user, kind, year, month, fmt),
+        f"{kind}-{year}-{month:02}.{fmt}",
+        fmt,
+    )
+
+
+def statement_response(lines, filename, fmt):
+    response = StreamingHttpResponse(lines, content_type=statements.FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
 def webhook_received(request):
     if not request.method == "POST":
         return HttpResponse(status=400)
 
+    stripe = get_stripe()
     # Verify webhook signature and extract the event.
     # See https://stripe.com/docs/webhooks/signatures for more information.
     try:
@@ -286,8 +393,23 @@ def webhook_received(request):
     return HttpResponse(status=200)
 
 
+@transaction.atomic
 def handle_completed_checkout_session(session):
     purchase_id = session.metadata.get("purchase_id")
-    purchase = ProductPurchase.objects.get(id=purchase_id)
+    purchase = ProductPurchase.objects.select_for_update().get(id=purchase_id)
+    if purchase.completed:
+        # Stripe retries webhooks, the purchase is already counted.
+        return
+    if purchase.expired:
+        # Paid after the reaper gave the stock back, take it again.
+        Product.objects.filter(id=purchase.product_id).update(
+            total_quantity=F("total_quantity") - purchase.quantity
+        )
+        transaction.on_commit(lambda: inventory.forget(purchase.product_id))
+        purchase.expired = False
     purchase.completed = True
     purchase.save()
+    analytics.record_sales([purchase])
+    seller_id = Product.objects.values_list("user_id", flat=True).get(id=purchase.product_id)
+    transaction.on_commit(lambda: statements.invalidate([purchase]))
+    transaction.on_commit(lambda: dashboard.forget(purchase.buyer_id, seller_id))